@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+This script measures the startup time of the entry point of every component (the time it takes to run
+them with --help, which is dominated by the imports at the top of the script), so that startup
+regressions are visible. Run it in an environment containing the dependencies of the components.
+
+To keep the startup fast, the entry points import their heavy dependencies (pandas, sklearn, mlflow,
+wandb...) inside the functions that use them, and not at the top of the script
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+# NOTE: src/basic_cleaning/run.py is not included: it is a scaffold to be completed, so it cannot run yet
+_entry_points = [
+    "main.py",
+    "sweep.py",
+    "components/get_data/run.py",
+    "components/get_data/ingest.py",
+    "components/train_val_test_split/run.py",
+    "components/test_regression_model/run.py",
+    "src/train_random_forest/run.py",
+    "src/train_random_forest/distributed.py",
+    "src/train_random_forest/benchmark_text_featurizer.py",
+    "src/model_diagnostics/run.py",
+]
+
+# Format of the lines printed by python -X importtime:
+# import time: self [us] | cumulative | imported package
+_import_time_line = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure(entry_point, repeat):
+    """
+    Run the entry point with --help, returning the best wall time over repeat runs and the slowest
+    top-level imports (as a list of (cumulative seconds, module) tuples)
+    """
+    cwd, script = os.path.split(os.path.abspath(entry_point))
+
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", script, "--help"], cwd=cwd, capture_output=True, text=True
+        )
+        wall_times.append(time.perf_counter() - start)
+
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1:]
+
+    # Top-level imports are the ones with a single space of indentation
+    imports = [
+        (int(m.group(2)) / 1e6, m.group(4))
+        for m in map(_import_time_line.match, result.stderr.splitlines())
+        if m and len(m.group(3)) == 1
+    ]
+
+    return min(wall_times), sorted(imports, reverse=True)[:3]
+
+
+def go(args):
+
+    failed = []
+    print(f"{'entry point':55} {'startup [s]':>12}  slowest imports")
+    for entry_point in _entry_points:
+        wall_time, slowest = measure(entry_point, args.repeat)
+
+        if wall_time is None:
+            print(f"{entry_point:55} {'failed':>12}  {' '.join(slowest)}")
+            failed.append(entry_point)
+            continue
+
+        details = ", ".join(f"{module} ({seconds:.3f}s)" for seconds, module in slowest)
+        print(f"{entry_point:55} {wall_time:12.3f}  {details}")
+
+        if wall_time > args.max_seconds:
+            failed.append(entry_point)
+
+    if failed:
+        print(f"Failed or slower than {args.max_seconds}s to start: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Measure the startup time of the component entry points")
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        help="Number of runs for each entry point (the best one is reported)",
+        default=3,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        help="Exit with an error if any entry point takes longer than this to start",
+        default=1.0,
+        required=False,
+    )
+
+    args = parser.parse_args()
+
+    go(args)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+This script ingests several samples at once (a list or a glob), logging them as raw_data artifacts,
+cleaning them in parallel (with the same cleaning as basic_cleaning) and merging them in a single cleaned
+artifact partitioned by neighbourhood_group or by month of the last review
+"""
+import argparse
+import glob
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def resolve_samples(samples):
+    """
+    Return the paths of the samples in the data directory matching a comma-separated list of names or globs
+    """
+    paths = []
+    for pattern in samples.split(","):
+        matches = sorted(glob.glob(os.path.join("data", pattern.strip())))
+        if not matches:
+            raise FileNotFoundError(f"No sample matching {pattern}")
+        paths.extend(m for m in matches if m not in paths)
+
+    return paths
+
+
+def partition_key(df, partition_by):
+    if partition_by == "month":
+        return df["last_review"].dt.strftime("%Y-%m").fillna("unknown")
+
+    return df[partition_by].fillna("unknown").astype(str)
+
+
+def clean_sample(path, min_price, max_price, partition_by, output_dir):
+    """
+    Clean one sample and write it in output_dir as one CSV file per partition, in the layout
+    [output_dir]/[partition_by]=[value]/part-[sample name].csv
+
+    :return: a dictionary partition value -> number of rows written for this sample
+    """
+    import pandas as pd
+
+    from wandb_utils.cleaning import clean_listings
+
+    df = clean_listings(pd.read_csv(path), min_price, max_price)
+
+    part_name = f"part-{os.path.splitext(os.path.basename(path))[0]}.csv"
+
+    counts = {}
+    for value, partition in df.groupby(partition_key(df, partition_by)):
+        partition_dir = os.path.join(output_dir, f"{partition_by}={value.replace('/', '_')}")
+        os.makedirs(partition_dir, exist_ok=True)
+        partition.to_csv(os.path.join(partition_dir, part_name), index=False)
+        counts[value] = len(partition)
+
+    logger.info(f"Cleaned {path}: {len(df)} rows in {len(counts)} partitions")
+
+    return counts
+
+
+def go(args):
+    import wandb
+
+    from wandb_utils.log_artifact import log_artifact
+
+    run = wandb.init(job_type="ingest_samples")
+    run.config.update(args)
+
+    paths = resolve_samples(args.samples)
+    logger.info(f"Ingesting {len(paths)} samples with {args.n_workers} workers")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+
+        # Each worker writes its own files in the partition directories, so merging the partial
+        # outputs does not require moving any data
+        with ProcessPoolExecutor(max_workers=args.n_workers) as executor:
+            futures = [
+                executor.submit(
+                    clean_sample, path, args.min_price, args.max_price, args.partition_by, output_dir
+                )
+                for path in paths
+            ]
+
+            # Log the raw samples (like the download step does) while the workers clean them, so that
+            # the cleaned artifact can be traced back to the raw data it comes from
+            for path in paths:
+                log_artifact(os.path.basename(path), "raw_data", "Raw file as downloaded", path, run)
+
+            partition_counts = {}
+            for future in futures:
+                for value, count in future.result().items():
+                    partition_counts[value] = partition_counts.get(value, 0) + count
+
+        logger.info(f"Uploading {args.artifact_name} to Weights & Biases")
+        artifact = wandb.Artifact(
+            args.artifact_name,
+            type=args.artifact_type,
+            description=args.artifact_description,
+            metadata={
+                "samples": [os.path.basename(p) for p in paths],
+                "partition_by": args.partition_by,
+                "partitions": partition_counts,
+            },
+        )
+        artifact.add_dir(output_dir)
+        run.log_artifact(artifact)
+        artifact.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and clean several samples in parallel")
+
+    parser.add_argument(
+        "samples", type=str, help="Comma-separated list of names (or globs) of the samples to ingest"
+    )
+
+    parser.add_argument("artifact_name", type=str, help="Name for the output artifact")
+
+    parser.add_argument("artifact_type", type=str, help="Output artifact type.")
+
+    parser.add_argument(
+        "artifact_description", type=str, help="A brief description of this artifact"
+    )
+
+    parser.add_argument("--min_price", type=float, help="Minimum price to be considered", required=True)
+
+    parser.add_argument("--max_price", type=float, help="Maximum price to be considered", required=True)
+
+    parser.add_argument(
+        "--partition_by",
+        type=str,
+        help="Column to partition the cleaned data by, or 'month' for the month of the last review",
+        default="neighbourhood_group",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--n_workers", type=int, help="Number of worker processes", default=os.cpu_count(), required=False
+    )
+
+    args = parser.parse_args()
+
+    go(args)
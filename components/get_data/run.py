@@ -6,15 +6,14 @@ import argparse
 import logging
 import os
 
-import wandb
-
-from wandb_utils.log_artifact import log_artifact
-
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
 def go(args):
+    import wandb
+
+    from wandb_utils.log_artifact import log_artifact
 
     run = wandb.init(job_type="download_file")
     run.config.update(args)
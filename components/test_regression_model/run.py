@@ -1,15 +1,10 @@
 #!/usr/bin/env python
 """
-This step takes the best model, tagged with the "prod" tag, and tests it against the test dataset
+This step takes the best model, tagged with the "prod" tag, and tests it against the test dataset.
+Optionally, it also scores other (challenger) models in the same pass and logs a comparison table
 """
 import argparse
 import logging
-import wandb
-import mlflow
-import pandas as pd
-from sklearn.metrics import mean_absolute_error
-
-from wandb_utils.log_artifact import log_artifact
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -17,37 +12,46 @@ logger = logging.getLogger()
 
 
 def go(args):
+    import pandas as pd
+    import wandb
+
+    from scoring import score_models
+    from wandb_utils.model_cache import load_model
 
     run = wandb.init(job_type="test_model")
     run.config.update(args)
 
     logger.info("Downloading artifacts")
-    # Download input artifact. This will also log that this script is using this
+    # Download test dataset. This will also log that this script is using this
     # particular version of the artifact
-    model_local_path = run.use_artifact(args.mlflow_model).download()
-
-    # Download test dataset
     test_dataset_path = run.use_artifact(args.test_dataset).file()
 
-    # Read test dataset
+    # Read test dataset (only once, whatever the number of models)
     X_test = pd.read_csv(test_dataset_path)
     y_test = X_test.pop("price")
 
-    logger.info("Loading model and performing inference on test set")
-    sk_pipe = mlflow.sklearn.load_model(model_local_path)
-    y_pred = sk_pipe.predict(X_test)
+    logger.info("Loading models and performing inference on test set")
+    # The models are downloaded (and deserialized) only if they are not in the local cache already
+    model_names = [args.mlflow_model] + [m for m in args.challenger_models.split(",") if m]
+    pipes = {}
+    fingerprints = {}
+    for name in model_names:
+        pipes[name], artifact = load_model(run, name, cache_dir=args.model_cache_dir)
+        # Models exported with the same preprocessing fingerprint share the transformed test set
+        fingerprints[name] = artifact.metadata.get("preprocessing_fingerprint")
 
     logger.info("Scoring")
-    r_squared = sk_pipe.score(X_test, y_test)
+    results = score_models(pipes, X_test, y_test, fingerprints)
 
-    mae = mean_absolute_error(y_test, y_pred)
+    for result in results:
+        logger.info(f"{result['model']}: Score: {result['r2']} MAE: {result['mae']}")
 
-    logger.info(f"Score: {r_squared}")
-    logger.info(f"MAE: {mae}")
+    # Log MAE and r2 of the model under test
+    run.summary['r2'] = results[0]['r2']
+    run.summary['mae'] = results[0]['mae']
 
-    # Log MAE and r2
-    run.summary['r2'] = r_squared
-    run.summary['mae'] = mae
+    if len(results) > 1:
+        run.log({"model_comparison": wandb.Table(dataframe=pd.DataFrame(results))})
 
 
 if __name__ == "__main__":
@@ -68,6 +72,22 @@ if __name__ == "__main__":
         required=True
     )
 
+    parser.add_argument(
+        "--challenger_models",
+        type=str,
+        help="Comma-separated list of other MLFlow models to score and compare against --mlflow_model",
+        default="",
+        required=False
+    )
+
+    parser.add_argument(
+        "--model_cache_dir",
+        type=str,
+        help="Local cache for the downloaded models (default: $MODEL_CACHE_DIR or ~/.cache/nyc_airbnb/models)",
+        default=None,
+        required=False
+    )
+
     args = parser.parse_args()
 
     go(args)
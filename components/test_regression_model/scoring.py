@@ -0,0 +1,54 @@
+import logging
+import time
+
+from sklearn.metrics import mean_absolute_error, r2_score
+
+
+logger = logging.getLogger()
+
+
+def score_models(pipes, X, y, fingerprints=None):
+    """
+    Score several pipelines on the same dataset in a single pass. Pipelines with the same preprocessing
+    fingerprint (recorded by train_random_forest in the metadata of the model export) transform the data
+    only once, and only their final estimator is run separately
+
+    :param pipes: dictionary of name -> fitted sklearn pipeline
+    :param X: features
+    :param y: target
+    :param fingerprints: dictionary of name -> preprocessing fingerprint. Pipelines without a fingerprint
+                         (None or missing) get their own preprocessing
+    :return: a list of dictionaries (one per pipeline, in the same order as pipes) containing the metrics
+             and the latency of each pipeline
+    """
+    fingerprints = fingerprints or {}
+
+    groups = {}
+    for name in pipes:
+        groups.setdefault(fingerprints.get(name) or f"unknown-{name}", []).append(name)
+
+    results = {}
+    for group_id, (fingerprint, names) in enumerate(groups.items()):
+        logger.info(f"Preprocessing the data once for {', '.join(names)}")
+
+        start = time.perf_counter()
+        features = pipes[names[0]][:-1].transform(X)
+        preprocess_time = time.perf_counter() - start
+
+        for name in names:
+            start = time.perf_counter()
+            y_pred = pipes[name][-1].predict(features)
+            predict_time = time.perf_counter() - start
+
+            results[name] = {
+                "model": name,
+                "r2": r2_score(y, y_pred),
+                "mae": mean_absolute_error(y, y_pred),
+                "preprocessor_group": group_id,
+                "preprocess_s": preprocess_time,
+                "predict_s": predict_time,
+                # Latency of the full pipeline (preprocessing + prediction) per row
+                "latency_ms_per_row": 1000 * (preprocess_time + predict_time) / len(X),
+            }
+
+    return [results[name] for name in pipes]
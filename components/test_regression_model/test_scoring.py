@@ -0,0 +1,54 @@
+import cloudpickle
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from scoring import score_models
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame({"a": rng.random(200), "b": rng.random(200)})
+    y = 3 * X["a"] + rng.random(200)
+    return X, y
+
+
+def make_exported_pipe(X, y, seed):
+    # Like delta_date_feature in train_random_forest, this function is serialized by value by cloudpickle
+    def double(values):
+        return 2 * values
+
+    sk_pipe = Pipeline(
+        steps=[
+            ("preprocessor", FunctionTransformer(double)),
+            ("random_forest", RandomForestRegressor(n_estimators=5, random_state=seed)),
+        ]
+    ).fit(X, y)
+
+    # Round trip through cloudpickle, as mlflow does when exporting and loading the model
+    return cloudpickle.loads(cloudpickle.dumps(sk_pipe))
+
+
+def test_same_fingerprint_shares_preprocessing(data):
+    X, y = data
+    pipes = {"prod": make_exported_pipe(X, y, 0), "challenger": make_exported_pipe(X, y, 1)}
+
+    results = score_models(pipes, X, y, {"prod": "abc", "challenger": "abc"})
+
+    assert [r["model"] for r in results] == ["prod", "challenger"]
+    assert results[0]["preprocessor_group"] == results[1]["preprocessor_group"]
+    for result, sk_pipe in zip(results, pipes.values()):
+        assert np.isclose(result["r2"], sk_pipe.score(X, y))
+
+
+def test_missing_or_different_fingerprints_are_not_shared(data):
+    X, y = data
+    pipes = {name: make_exported_pipe(X, y, 0) for name in ["prod", "challenger", "old"]}
+
+    results = score_models(pipes, X, y, {"prod": "abc", "challenger": "def"})
+
+    assert len({r["preprocessor_group"] for r in results}) == 3
@@ -4,17 +4,19 @@ This script splits the provided dataframe in test and remainder
 """
 import argparse
 import logging
-import pandas as pd
-import wandb
 import tempfile
-from sklearn.model_selection import train_test_split
-from wandb_utils.log_artifact import log_artifact
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
 def go(args):
+    import pandas as pd
+    import wandb
+    from sklearn.model_selection import train_test_split
+
+    from wandb_utils.log_artifact import log_artifact
+    from wandb_utils.partitions import read_partitions
 
     run = wandb.init(job_type="train_val_test_split")
     run.config.update(args)
@@ -22,9 +24,15 @@ def go(args):
     # Download input artifact. This will also note that this script is using this
     # particular version of the artifact
     logger.info(f"Fetching artifact {args.input}")
-    artifact_local_path = run.use_artifact(args.input).file()
+    artifact = run.use_artifact(args.input)
 
-    df = pd.read_csv(artifact_local_path)
+    if artifact.metadata.get("partition_by"):
+        # Partitioned artifact (created by the ingest entry point of get_data): only read the
+        # partitions that are needed
+        values = None if args.partitions == "all" else args.partitions.split(",")
+        df = read_partitions(artifact.download(), values)
+    else:
+        df = pd.read_csv(artifact.file())
 
     logger.info("Splitting trainval and test")
     trainval, test = train_test_split(
@@ -67,6 +75,14 @@ if __name__ == "__main__":
         "--stratify_by", type=str, help="Column to use for stratification", default='none', required=False
     )
 
+    parser.add_argument(
+        "--partitions",
+        type=str,
+        help="Comma-separated list of the partitions to read, if the input is a partitioned artifact",
+        default='all',
+        required=False,
+    )
+
     args = parser.parse_args()
 
     go(args)
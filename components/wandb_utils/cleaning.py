@@ -0,0 +1,23 @@
+def clean_listings(df, min_price, max_price):
+    """
+    Apply the basic cleaning of the basic_cleaning step to a dataframe of listings: drop the price outliers
+    and the listings outside of NYC (the boundaries checked by test_proper_boundaries), and convert
+    last_review to datetime
+
+    :param df: pandas DataFrame with the raw listings
+    :param min_price: minimum price to be considered
+    :param max_price: maximum price to be considered
+    :return: the cleaned pandas DataFrame
+    """
+    import pandas as pd
+
+    # Drop outliers
+    idx = df["price"].between(min_price, max_price)
+    # Drop listings outside of NYC
+    idx &= df["longitude"].between(-74.25, -73.50) & df["latitude"].between(40.5, 41.2)
+    df = df[idx].copy()
+
+    # Convert last_review to datetime
+    df["last_review"] = pd.to_datetime(df["last_review"])
+
+    return df
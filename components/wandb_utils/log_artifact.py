@@ -1,7 +1,3 @@
-import wandb
-import mlflow
-
-
 def log_artifact(artifact_name, artifact_type, artifact_description, filename, wandb_run):
     """
     Log the provided filename as an artifact in W&B, and add the artifact path to the MLFlow run
@@ -14,6 +10,8 @@ def log_artifact(artifact_name, artifact_type, artifact_description, filename, w
     :param wandb_run: current Weights & Biases run
     :return: None
     """
+    import wandb
+
     # Log to W&B
     artifact = wandb.Artifact(
         artifact_name,
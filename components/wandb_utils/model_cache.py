@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+
+logger = logging.getLogger()
+
+# In-process registry of the deserialized models, keyed by artifact digest (most recently used last)
+_registry = OrderedDict()
+
+
+def default_cache_dir():
+    """
+    Return the directory of the local model cache: $MODEL_CACHE_DIR if set, ~/.cache/nyc_airbnb/models otherwise
+    """
+    return os.environ.get("MODEL_CACHE_DIR", os.path.expanduser("~/.cache/nyc_airbnb/models"))
+
+
+def load_model(wandb_run, artifact_name, cache_dir=None, max_cached=5, max_in_memory=3):
+    """
+    Load the MLflow sklearn model contained in a W&B artifact, using a local cache of the downloaded
+    models keyed by artifact digest and an in-process registry of the deserialized ones.
+
+    The artifact name (and alias, like "random_forest_export:prod") is resolved to a digest first, so the
+    model is downloaded and deserialized again only when the alias points to a different model
+
+    :param wandb_run: current Weights & Biases run (used to record the use of the artifact)
+    :param artifact_name: name of the model artifact, including the version or alias (or an artifact
+                          already returned by use_artifact)
+    :param cache_dir: directory of the local cache (see default_cache_dir)
+    :param max_cached: maximum number of models kept in the local cache (least recently used are removed)
+    :param max_in_memory: maximum number of deserialized models kept in the in-process registry
+    :return: a tuple (sk_pipe, artifact) with the deserialized sklearn pipeline and the artifact it was
+             resolved to. Read the metadata of the model from this artifact: resolving the alias again
+             could give a different model
+    """
+    cache_dir = cache_dir or default_cache_dir()
+
+    # This will also log that this script is using this particular version of the artifact
+    artifact = wandb_run.use_artifact(artifact_name)
+    digest = artifact.digest
+
+    if digest in _registry:
+        logger.info(f"{artifact_name} ({digest}) is already loaded")
+        _registry.move_to_end(digest)
+        return _registry[digest], artifact
+
+    local_path = os.path.join(cache_dir, digest)
+    if os.path.exists(local_path):
+        logger.info(f"{artifact_name} ({digest}) found in the local cache")
+        # The modification time is used to find the least recently used models
+        os.utime(local_path)
+    else:
+        logger.info(f"Downloading {artifact_name} ({digest}) to the local cache")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Download to a temporary directory and then rename it, so concurrent jobs never
+        # see a partially downloaded model
+        tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix=".download-")
+        try:
+            artifact.download(root=tmp_path)
+        except Exception:
+            shutil.rmtree(tmp_path)
+            raise
+
+        try:
+            os.rename(tmp_path, local_path)
+        except OSError:
+            # Another job downloaded the same model in the meantime
+            shutil.rmtree(tmp_path)
+
+        _evict(cache_dir, max_cached, keep=digest)
+
+    import mlflow
+
+    sk_pipe = mlflow.sklearn.load_model(local_path)
+
+    _registry[digest] = sk_pipe
+    while len(_registry) > max_in_memory:
+        _registry.popitem(last=False)
+
+    return sk_pipe, artifact
+
+
+def _evict(cache_dir, max_cached, keep):
+    entries = sorted(
+        (e for e in os.scandir(cache_dir) if e.is_dir() and not e.name.startswith(".")),
+        key=lambda e: e.stat().st_mtime,
+    )
+
+    for entry in entries[: max(len(entries) - max_cached, 0)]:
+        if entry.name != keep:
+            logger.info(f"Removing {entry.name} from the local model cache")
+            shutil.rmtree(entry.path, ignore_errors=True)
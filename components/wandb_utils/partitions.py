@@ -0,0 +1,28 @@
+import glob
+import os
+
+
+def read_partitions(path, values=None):
+    """
+    Read a dataset partitioned in the layout [path]/[column]=[value]/*.csv (like the one created by the
+    ingest entry point of get_data), only reading the partitions that are needed
+
+    :param path: root directory of the partitioned dataset
+    :param values: values of the partitions to read (all of them if None)
+    :return: a pandas DataFrame
+    :raises ValueError: if no partition (or no file) matches the selection
+    """
+    import pandas as pd
+
+    frames = []
+    for partition_dir in sorted(glob.glob(os.path.join(path, "*=*"))):
+        value = os.path.basename(partition_dir).split("=", 1)[1]
+        if values is not None and value not in values:
+            continue
+
+        frames.extend(pd.read_csv(f) for f in sorted(glob.glob(os.path.join(partition_dir, "*.csv"))))
+
+    if not frames:
+        raise ValueError(f"No partition of {path} matching {values}")
+
+    return pd.concat(frames, ignore_index=True)
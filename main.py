@@ -1,9 +1,7 @@
 import json
 
-import mlflow
 import tempfile
 import os
-import wandb
 import hydra
 from omegaconf import DictConfig
 
@@ -17,12 +15,19 @@ _steps = [
     # You first need to promote a model export to "prod" before you can run this,
     # then you need to run this step explicitly
 #    "test_regression_model"
+    # NOTE: this is not included either. Run it explicitly to download and clean in parallel all the samples
+    # matching etl.samples, in a single artifact partitioned by etl.partition_by
+#    "ingest_samples",
+    # NOTE: this is not included either. Run it explicitly (after train_random_forest) to compute the
+    # permutation importance and the error breakdown of a model, off the training critical path
+#    "model_diagnostics"
 ]
 
 
 # This automatically reads in the configuration
 @hydra.main(version_base=None, config_name='config', config_path='.')
 def go(config: DictConfig):
+    import mlflow
 
     # Setup the wandb experiment. All runs will be grouped under this name
     os.environ["WANDB_PROJECT"] = config["main"]["project_name"]
@@ -49,6 +54,23 @@ def go(config: DictConfig):
                 },
             )
 
+        if "ingest_samples" in active_steps:
+            _ = mlflow.run(
+                f"{config['main']['components_repository']}/get_data",
+                "ingest",
+                env_manager="conda",
+                parameters={
+                    "samples": config["etl"]["samples"],
+                    "artifact_name": "clean_sample_partitioned",
+                    "artifact_type": "clean_sample",
+                    "artifact_description": f"Data cleaned and partitioned by {config['etl']['partition_by']}",
+                    "min_price": config["etl"]["min_price"],
+                    "max_price": config["etl"]["max_price"],
+                    "partition_by": config["etl"]["partition_by"],
+                    "n_workers": config["etl"]["n_workers"],
+                },
+            )
+
         if "basic_cleaning" in active_steps:
             ##################
             # Implement here #
@@ -83,6 +105,22 @@ def go(config: DictConfig):
 
             pass
 
+        if "model_diagnostics" in active_steps:
+            _ = mlflow.run(
+                os.path.join(hydra.utils.get_original_cwd(), "src", "model_diagnostics"),
+                "main",
+                env_manager="conda",
+                parameters={
+                    "mlflow_model": config["diagnostics"]["mlflow_model"],
+                    "trainval_artifact": "trainval_data.csv:latest",
+                    "val_size": config["modeling"]["val_size"],
+                    "random_seed": config["modeling"]["random_seed"],
+                    "stratify_by": config["modeling"]["stratify_by"],
+                    "n_repeats": config["diagnostics"]["n_repeats"],
+                    "n_jobs": config["diagnostics"]["n_jobs"],
+                },
+            )
+
         if "test_regression_model" in active_steps:
 
             ##################
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+This step computes diagnostics for a trained model on the validation set, off the training critical path:
+the permutation importance of each input column and the breakdown of the errors by neighbourhood.
+The results are cached (locally and as a W&B artifact) keyed by the version of the model and of the data,
+so they are computed only once for each model
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def go(args):
+    import wandb
+
+    from wandb_utils.model_cache import load_model
+
+    run = wandb.init(job_type="model_diagnostics")
+    run.config.update(args)
+
+    # This will also log that this script is using these particular versions of the artifacts
+    model_artifact = run.use_artifact(args.mlflow_model)
+    trainval_artifact = run.use_artifact(args.trainval_artifact)
+
+    cache_key = get_cache_key(model_artifact.digest, trainval_artifact.digest, args)
+    cache_artifact_name = f"model_diagnostics-{cache_key}"
+    cache_path = os.path.join(args.cache_dir, f"{cache_key}.json")
+
+    if not os.path.exists(cache_path) and wandb.Api().artifact_exists(
+        f"{run.entity}/{run.project}/{cache_artifact_name}:latest"
+    ):
+        logger.info(f"Fetching cached diagnostics from {cache_artifact_name}")
+        run.use_artifact(f"{cache_artifact_name}:latest").download(root=args.cache_dir)
+
+    if os.path.exists(cache_path):
+        logger.info(f"Using cached diagnostics {cache_path}")
+        with open(cache_path) as fp:
+            diagnostics = json.load(fp)
+    else:
+        # The model is downloaded (and deserialized) only if it is not in the local model cache already.
+        # Pass the resolved artifact, so the model is the one the cache key refers to
+        sk_pipe, _ = load_model(run, model_artifact)
+        diagnostics = compute_diagnostics(sk_pipe, trainval_artifact.file(), args)
+
+        os.makedirs(args.cache_dir, exist_ok=True)
+        with open(cache_path, "w") as fp:
+            json.dump(diagnostics, fp)
+
+        artifact = wandb.Artifact(
+            cache_artifact_name,
+            type="model_diagnostics",
+            description=f"Diagnostics for {args.mlflow_model} on the validation set",
+            metadata={"mlflow_model": args.mlflow_model, "model_digest": model_artifact.digest},
+        )
+        artifact.add_file(cache_path)
+        run.log_artifact(artifact)
+
+    log_diagnostics(run, diagnostics)
+
+
+def get_cache_key(model_digest, data_digest, args):
+    """
+    Return a key identifying the diagnostics for a given model, dataset and validation split
+    """
+    key = json.dumps(
+        [model_digest, data_digest, args.val_size, args.random_seed, args.stratify_by, args.n_repeats]
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def compute_diagnostics(sk_pipe, trainval_local_path, args):
+    """
+    Compute the permutation importance and the error breakdown by neighbourhood of the model on the
+    validation split of the trainval dataset (the same split used by the train_random_forest step)
+
+    :return: a dictionary of records, which can be serialized to JSON
+    """
+    import numpy as np
+    import pandas as pd
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import train_test_split
+
+    logger.info("Loading data")
+
+    X = pd.read_csv(trainval_local_path)
+    y = X.pop("price")
+
+    _, X_val, _, y_val = train_test_split(
+        X,
+        y,
+        test_size=args.val_size,
+        stratify=X[args.stratify_by] if args.stratify_by != "none" else None,
+        random_state=args.random_seed,
+    )
+    X_val = X_val.reset_index(drop=True)
+    y_val = y_val.to_numpy()
+
+    y_pred = sk_pipe.predict(X_val)
+    baseline_mae = np.abs(y_pred - y_val).mean()
+    logger.info(f"Validation MAE: {baseline_mae}")
+
+    logger.info("Computing the error breakdown by neighbourhood")
+    errors = X_val[["neighbourhood_group", "neighbourhood"]].assign(error=y_pred - y_val)
+    errors["abs_error"] = errors["error"].abs()
+    breakdown = {
+        by: (
+            errors.groupby(by)
+            .agg(count=("error", "size"), mae=("abs_error", "mean"), bias=("error", "mean"))
+            .reset_index()
+            .sort_values("mae", ascending=False)
+            .to_dict(orient="records")
+        )
+        for by in ["neighbourhood_group", "neighbourhood"]
+    }
+
+    logger.info(f"Computing the permutation importance with {args.n_repeats} repeats")
+    # The columns are processed in parallel, so each random forest uses a single core
+    if "n_jobs" in sk_pipe[-1].get_params():
+        sk_pipe[-1].set_params(n_jobs=1)
+
+    columns = get_input_columns(sk_pipe, X_val)
+    importances = Parallel(n_jobs=args.n_jobs)(
+        delayed(permutation_importance_column)(
+            sk_pipe, X_val, y_val, column, args.n_repeats, args.random_seed + i, baseline_mae
+        )
+        for i, column in enumerate(columns)
+    )
+
+    return {
+        "baseline_mae": float(baseline_mae),
+        "permutation_importance": sorted(importances, key=lambda r: r["importance_mean"], reverse=True),
+        "neighbourhood_group_errors": breakdown["neighbourhood_group"],
+        "neighbourhood_errors": breakdown["neighbourhood"],
+    }
+
+
+def get_input_columns(sk_pipe, X):
+    """
+    Return the input columns actually used by the preprocessor of the pipeline (all the columns
+    of X if that cannot be determined)
+    """
+    columns = []
+    for name, transformer, transformer_columns in getattr(sk_pipe[0], "transformers_", []):
+        if transformer != "drop" and name != "remainder":
+            columns.extend(c for c in transformer_columns if c not in columns)
+
+    return columns or list(X.columns)
+
+
+def permutation_importance_column(sk_pipe, X, y, column, n_repeats, seed, baseline_mae):
+    """
+    Compute the increase of the MAE when the values of column are randomly permuted, over n_repeats
+    permutations. All the permuted copies of X are scored with a single vectorized call to predict
+
+    NOTE: permuting a column does not change its maximum, so batching the copies together does not change
+    the transform of batch-dependent features like delta_date_feature
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+
+    X_permuted = pd.concat([X] * n_repeats, ignore_index=True)
+    X_permuted[column] = np.concatenate([rng.permutation(X[column].to_numpy()) for _ in range(n_repeats)])
+
+    y_pred = sk_pipe.predict(X_permuted).reshape(n_repeats, len(X))
+    increase = np.abs(y_pred - y).mean(axis=1) - baseline_mae
+
+    return {
+        "feature": column,
+        "importance_mean": float(increase.mean()),
+        "importance_std": float(increase.std()),
+    }
+
+
+def log_diagnostics(run, diagnostics):
+    import pandas as pd
+    import wandb
+
+    importance = wandb.Table(dataframe=pd.DataFrame(diagnostics["permutation_importance"]))
+    run.log(
+        {
+            "permutation_importance": wandb.plot.bar(
+                importance, "feature", "importance_mean", title="Permutation importance (MAE increase)"
+            ),
+            "permutation_importance_table": importance,
+            "neighbourhood_group_errors": wandb.Table(
+                dataframe=pd.DataFrame(diagnostics["neighbourhood_group_errors"])
+            ),
+            "neighbourhood_errors": wandb.Table(dataframe=pd.DataFrame(diagnostics["neighbourhood_errors"])),
+        }
+    )
+    run.summary["baseline_mae"] = diagnostics["baseline_mae"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compute diagnostics for a trained model")
+
+    parser.add_argument(
+        "--mlflow_model",
+        type=str,
+        help="Input MLFlow model",
+        required=True
+    )
+
+    parser.add_argument(
+        "--trainval_artifact",
+        type=str,
+        help="Artifact containing the training dataset. It will be split into train and validation "
+        "exactly as in the train_random_forest step",
+        required=True
+    )
+
+    parser.add_argument(
+        "--val_size",
+        type=float,
+        help="Size of the validation split. Fraction of the dataset, or number of items",
+        required=True
+    )
+
+    parser.add_argument(
+        "--random_seed",
+        type=int,
+        help="Seed for random number generator",
+        default=42,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--stratify_by",
+        type=str,
+        help="Column to use for stratification",
+        default="none",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--n_repeats",
+        type=int,
+        help="Number of times each column is permuted to compute the permutation importance",
+        default=5,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        help="Number of parallel jobs (-1 means all available cores)",
+        default=-1,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Local directory where the diagnostics are cached",
+        default=os.path.expanduser("~/.cache/nyc_airbnb/model_diagnostics"),
+        required=False,
+    )
+
+    args = parser.parse_args()
+
+    go(args)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+This script benchmarks the featurizers available for the title of the insertion (the "name" column):
+fit time (also streaming the documents in chunks with partial_fit, for the hashing featurizer), transform
+throughput, and size of the serialized featurizer and of the whole fitted preprocessor of the model
+"""
+import argparse
+import logging
+import pickle
+import time
+
+from run import get_inference_pipeline
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def benchmark(name, preprocessor, docs, X, y, chunksize, n_jobs):
+    from sklearn.base import clone
+
+    from feature_engineering import HashingTfidfVectorizer, transform_in_chunks
+
+    # The featurizer of the name column is the last step of the last transformer of the preprocessor
+    featurizer = clone(preprocessor.transformers[-1][1][-1])
+
+    start = time.perf_counter()
+    featurizer.fit(docs)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    featurizer.transform(docs)
+    transform_time = time.perf_counter() - start
+
+    result = {
+        "featurizer": name,
+        "fit_s": fit_time,
+        "transform_docs_per_s": len(docs) / transform_time,
+        "pickle_bytes": len(pickle.dumps(featurizer)),
+    }
+
+    # This is what the featurizer adds to the size of the exported model
+    preprocessor = clone(preprocessor).fit(X, y)
+    result["preprocessor_pickle_bytes"] = len(pickle.dumps(preprocessor))
+
+    # Only the hashing featurizer is row-wise independent, so only that one can be applied
+    # to chunks in parallel and give the same result
+    if isinstance(featurizer, HashingTfidfVectorizer):
+        start = time.perf_counter()
+        for i in range(0, len(docs), chunksize):
+            featurizer.partial_fit(docs[i: i + chunksize])
+        result["partial_fit_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        transform_in_chunks(featurizer, docs, chunksize=chunksize, n_jobs=n_jobs)
+        result["parallel_transform_docs_per_s"] = len(docs) / (time.perf_counter() - start)
+
+    logger.info(f"{name}: {result}")
+
+    return result
+
+
+def go(args):
+    import pandas as pd
+
+    logger.info(f"Reading {args.csv}")
+    X = pd.read_csv(args.csv)
+    y = X.pop("price")
+
+    # Replicate the corpus to simulate larger datasets
+    docs = pd.concat([X["name"].fillna("")] * args.repeat, ignore_index=True).to_numpy()
+    logger.info(f"Benchmarking on {len(docs)} documents")
+
+    featurizers = {
+        "tfidf": dict(text_featurizer="tfidf", max_tfidf_features=args.max_tfidf_features),
+        "tfidf_full_vocabulary": dict(text_featurizer="tfidf", max_tfidf_features=None),
+        "hashing_idf": dict(text_featurizer="hashing", hashing_use_idf=True),
+        "hashing": dict(text_featurizer="hashing", hashing_use_idf=False),
+    }
+
+    results = []
+    for name, params in featurizers.items():
+        params.setdefault("max_tfidf_features", args.max_tfidf_features)
+        sk_pipe, _ = get_inference_pipeline({}, hashing_n_features=args.hashing_n_features, **params)
+        results.append(benchmark(name, sk_pipe["preprocessor"], docs, X, y, args.chunksize, args.n_jobs))
+
+    results = pd.DataFrame(results)
+
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the featurizers for the name column")
+
+    parser.add_argument(
+        "--csv",
+        type=str,
+        help="Path to a local CSV file with the columns of the training data (like trainval_data.csv)",
+        required=True
+    )
+
+    parser.add_argument(
+        "--max_tfidf_features",
+        help="Maximum number of words to consider for the TFIDF",
+        default=5,
+        type=int
+    )
+
+    parser.add_argument(
+        "--hashing_n_features",
+        help="Number of hashed columns for the 'hashing' text featurizer",
+        default=1024,
+        type=int
+    )
+
+    parser.add_argument(
+        "--repeat",
+        help="Number of times the corpus is replicated, to simulate larger datasets",
+        default=10,
+        type=int
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        help="Number of documents per chunk for the parallel transform",
+        default=10000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--n_jobs",
+        help="Number of parallel jobs for the chunked transform (-1 means all available cores)",
+        default=-1,
+        type=int
+    )
+
+    args = parser.parse_args()
+
+    go(args)
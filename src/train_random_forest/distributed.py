@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Distributed training of the random forest: subsets of the trees are fit in separate worker processes
+(each with its own seed) and then merged into a single RandomForestRegressor.
+
+The coordinator ships the preprocessed matrix to the workers only once, either through shared memory
+(workers on this machine) or through a socket (workers on this or other machines). Workers for the socket
+backend can be started on other nodes with:
+
+    > RF_WORKER_AUTHKEY=[secret] python distributed.py --address [coordinator host]:[port]
+"""
+import argparse
+import copy
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+AUTHKEY_ENV_VAR = "RF_WORKER_AUTHKEY"
+
+
+def split_estimators(n_estimators, n_shards, random_seed):
+    """
+    Split n_estimators trees in n_shards (almost) equal shards, each with its own independent seed
+
+    :return: a list of (number of trees, seed) tuples
+    """
+    seeds = [
+        int(s.generate_state(1)[0]) for s in np.random.SeedSequence(random_seed).spawn(n_shards)
+    ]
+    sizes = [len(a) for a in np.array_split(np.arange(n_estimators), n_shards)]
+
+    return [(size, seed) for size, seed in zip(sizes, seeds) if size > 0]
+
+
+def fit_forest_shard(X, y, rf_config, n_estimators, seed):
+    """
+    Fit a forest with n_estimators trees and the provided seed
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    rf_config = dict(rf_config, n_estimators=n_estimators, random_state=seed)
+    return RandomForestRegressor(**rf_config).fit(X, y)
+
+
+def merge_forests(forests, n_jobs=None):
+    """
+    Merge forests fit on the same data into a single forest containing all their trees, predicting
+    with n_jobs cores (the shards were fit with the number of cores of a worker)
+    """
+    merged = copy.deepcopy(forests[0])
+    for forest in forests[1:]:
+        merged.estimators_ += forest.estimators_
+
+    merged.n_estimators = len(merged.estimators_)
+    merged.n_jobs = n_jobs
+
+    return merged
+
+
+def _prepare_config(rf_config, worker_n_jobs):
+    rf_config = dict(rf_config)
+    if rf_config.pop("oob_score", False):
+        # The out-of-bag predictions of the shards cannot be merged
+        logger.warning("oob_score is not supported in distributed mode, ignoring it")
+
+    # Avoid oversubscribing the cores when several workers share the same machine
+    rf_config["n_jobs"] = worker_n_jobs
+
+    return rf_config
+
+
+def _fit_shard_from_shared_memory(shm_specs, rf_config, n_estimators, seed):
+    # track=False: the coordinator owns the shared memory, the workers must not unlink it
+    blocks = {k: SharedMemory(name=name, track=False) for k, (name, _, _) in shm_specs.items()}
+    try:
+        X, y = (
+            np.ndarray(shm_specs[k][1], dtype=shm_specs[k][2], buffer=blocks[k].buf) for k in ("X", "y")
+        )
+        forest = fit_forest_shard(X, y, rf_config, n_estimators, seed)
+        del X, y
+    finally:
+        for block in blocks.values():
+            block.close()
+
+    return forest
+
+
+def fit_shared_memory(X, y, rf_config, n_workers, random_seed, worker_n_jobs=1):
+    """
+    Fit a forest distributing the trees across n_workers local processes. The matrices are copied once
+    in shared memory, and the workers read them from there without further copies
+
+    :return: the merged RandomForestRegressor
+    """
+    n_jobs = rf_config.get("n_jobs")
+    rf_config = _prepare_config(rf_config, worker_n_jobs)
+    shards = split_estimators(rf_config.pop("n_estimators", 100), n_workers, random_seed)
+
+    arrays = {"X": np.ascontiguousarray(X, dtype=np.float32), "y": np.ascontiguousarray(y, dtype=np.float64)}
+    blocks = {k: SharedMemory(create=True, size=max(a.nbytes, 1)) for k, a in arrays.items()}
+    try:
+        shm_specs = {}
+        for k, a in arrays.items():
+            np.ndarray(a.shape, dtype=a.dtype, buffer=blocks[k].buf)[:] = a
+            shm_specs[k] = (blocks[k].name, a.shape, a.dtype.str)
+
+        logger.info(f"Fitting {len(shards)} shards on {n_workers} local workers (shared memory)")
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            forests = list(
+                executor.map(
+                    _fit_shard_from_shared_memory,
+                    *zip(*[(shm_specs, rf_config, n, seed) for n, seed in shards]),
+                )
+            )
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    return merge_forests(forests, n_jobs)
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def worker_loop(address, authkey):
+    """
+    Connect to the coordinator, receive the matrices once, then fit the shards the coordinator
+    sends until it says to stop
+    """
+    with Client(address, authkey=authkey) as conn:
+        X, y, rf_config = conn.recv()
+        logger.info(f"Received a {X.shape} matrix from the coordinator")
+
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            n_estimators, seed = message
+            conn.send(fit_forest_shard(X, y, rf_config, n_estimators, seed))
+
+
+def _serve_worker(conn, payload, tasks, forests):
+    with conn:
+        conn.send(payload)
+
+        # Workers pull shards as soon as they are done with the previous one, so faster
+        # workers get more shards
+        while True:
+            try:
+                shard = tasks.get_nowait()
+            except queue.Empty:
+                conn.send(None)
+                return
+
+            try:
+                conn.send(shard)
+                forests.append(conn.recv())
+            except (EOFError, OSError):
+                logger.warning(f"Lost the connection with a worker, putting back the shard {shard}")
+                tasks.put(shard)
+                return
+
+
+def _accept_connections(listener, n_workers, connections):
+    # multiprocessing's Listener.accept has no timeout, so it runs in a (daemon) thread and the
+    # coordinator waits on the queue instead
+    for _ in range(n_workers):
+        try:
+            connections.put(listener.accept())
+        except Exception as e:
+            connections.put(e)
+            return
+
+
+def fit_socket(
+    X,
+    y,
+    rf_config,
+    n_workers,
+    random_seed,
+    address="localhost:0",
+    n_local_workers=None,
+    worker_n_jobs=1,
+    connect_timeout=600,
+):
+    """
+    Fit a forest distributing the trees across n_workers worker processes connected through sockets.
+    n_local_workers of them are started on this machine, the others must be started on other nodes
+    (see worker_loop) with the same authentication key (environment variable RF_WORKER_AUTHKEY).
+    Raises a RuntimeError if a local worker dies, or if the workers do not all connect within
+    connect_timeout seconds
+
+    :return: the merged RandomForestRegressor
+    """
+    n_local_workers = n_workers if n_local_workers is None else n_local_workers
+
+    authkey = os.environ.get(AUTHKEY_ENV_VAR, "").encode()
+    if not authkey:
+        if n_local_workers < n_workers:
+            raise ValueError(f"You must set {AUTHKEY_ENV_VAR} to use remote workers")
+        authkey = secrets.token_bytes(32)
+
+    n_jobs = rf_config.get("n_jobs")
+    rf_config = _prepare_config(rf_config, worker_n_jobs)
+    # Use more shards than workers, so the load is balanced if the workers have different speeds
+    shards = split_estimators(rf_config.pop("n_estimators", 100), 4 * n_workers, random_seed)
+
+    tasks = queue.Queue()
+    for shard in shards:
+        tasks.put(shard)
+
+    forests = []
+    payload = (np.ascontiguousarray(X, dtype=np.float32), np.asarray(y), rf_config)
+
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        logger.info(f"Coordinator listening on {listener.address}, waiting for {n_workers} workers")
+
+        local_workers = [
+            Process(target=worker_loop, args=(listener.address, authkey), daemon=True)
+            for _ in range(n_local_workers)
+        ]
+        for process in local_workers:
+            process.start()
+
+        connections = queue.Queue()
+        threading.Thread(
+            target=_accept_connections, args=(listener, n_workers, connections), daemon=True
+        ).start()
+
+        deadline = time.monotonic() + connect_timeout
+        threads = []
+        try:
+            while len(threads) < n_workers:
+                try:
+                    conn = connections.get(timeout=1)
+                except queue.Empty:
+                    if any(process.exitcode not in (None, 0) for process in local_workers):
+                        raise RuntimeError("A local worker died while waiting for the workers to connect")
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(
+                            f"Only {len(threads)} of {n_workers} workers connected within {connect_timeout}s"
+                        )
+                    continue
+
+                if isinstance(conn, Exception):
+                    raise RuntimeError(f"Could not accept a worker: {conn}") from conn
+
+                logger.info(f"Worker connected from {listener.last_accepted}")
+                thread = threading.Thread(
+                    target=_serve_worker, args=(conn, payload, tasks, forests), daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+        except RuntimeError:
+            for process in local_workers:
+                process.kill()
+            raise
+
+        for thread in threads:
+            thread.join()
+
+    for process in local_workers:
+        process.join()
+
+    if len(forests) != len(shards):
+        raise RuntimeError(f"Only {len(forests)} of {len(shards)} shards were fit, some workers failed")
+
+    return merge_forests(forests, n_jobs)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Worker for the distributed training of the random forest")
+
+    parser.add_argument(
+        "--address",
+        type=str,
+        help="Address of the coordinator, in the form host:port",
+        required=True
+    )
+
+    args = parser.parse_args()
+
+    worker_loop(parse_address(args.address), os.environ[AUTHKEY_ENV_VAR].encode())
@@ -1,11 +1,175 @@
-import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from scipy.spatial import cKDTree
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.utils.validation import check_is_fitted
 
 
-def delta_date_feature(dates):
+class HashingTfidfVectorizer(TransformerMixin, BaseEstimator):
     """
-    Given a 2d array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
-    between each date and the most recent date in its column
+    Drop-in alternative to TfidfVectorizer for the "name" column based on feature hashing.
+
+    The tokens are hashed into a fixed number of columns, so there is no vocabulary to fit or to
+    store in the pickled model. If use_idf is True the document frequencies of the hashed columns are
+    accumulated with partial_fit, which gives a streaming IDF estimate that can be built chunk by chunk.
+    The transform is row-wise independent, so it can be applied to chunks in parallel
+    (see transform_in_chunks)
+
+    :param n_features: number of hashed columns
+    :param use_idf: whether to re-weight the hashed counts with the (streaming) inverse document frequency
+    :param stop_words: stop words passed to the underlying HashingVectorizer
+    """
+
+    def __init__(self, n_features=1024, use_idf=True, stop_words="english"):
+        self.n_features = n_features
+        self.use_idf = use_idf
+        self.stop_words = stop_words
+
+    def _hashing_vectorizer(self):
+        # NOTE: alternate_sign=False and norm=None give us plain term counts, which is what
+        # TfidfVectorizer(binary=False) works with before the IDF weighting
+        return HashingVectorizer(
+            n_features=self.n_features,
+            alternate_sign=False,
+            norm=None,
+            stop_words=self.stop_words,
+            dtype=np.float32,
+        )
+
+    def partial_fit(self, X, y=None):
+        """
+        Update the document frequencies with a new chunk of documents
+        """
+        if not hasattr(self, "n_documents_"):
+            self.n_documents_ = 0
+            # Without IDF there is nothing to store, so the fitted featurizer stays tiny
+            if self.use_idf:
+                self.document_frequency_ = np.zeros(self.n_features, dtype=np.int64)
+
+        if self.use_idf:
+            counts = self._hashing_vectorizer().transform(X)
+            self.document_frequency_ += np.bincount(counts.indices, minlength=self.n_features)
+
+        self.n_documents_ += len(X)
+
+        return self
+
+    def fit(self, X, y=None):
+        for attr in ("n_documents_", "document_frequency_"):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+        return self.partial_fit(X, y)
+
+    @property
+    def idf_(self):
+        # Same smoothed formula used by sklearn's TfidfTransformer
+        return (
+            np.log((1 + self.n_documents_) / (1 + self.document_frequency_)) + 1
+        ).astype(np.float32)
+
+    def transform(self, X):
+        check_is_fitted(self, "n_documents_")
+
+        counts = self._hashing_vectorizer().transform(X)
+
+        if self.use_idf:
+            counts = counts @ sp.diags(self.idf_)
+
+        return normalize(counts, norm="l2", copy=False)
+
+
+class GeoNeighbourFeatures(TransformerMixin, BaseEstimator):
+    """
+    Neighbourhood features computed from the latitude and longitude (in this order) of the listings.
+
+    fit builds a KD-tree over the listings of the training set (projected on a plane, in km) and keeps
+    their prices. transform then computes, for each row, the number of training listings within
+    radius_km and the median price of its n_neighbors nearest training listings. The queries are
+    vectorized over the whole batch, and a single listing is looked up in the tree without scanning
+    the training set.
+
+    During fit_transform each listing is excluded from its own neighbours, so the target of a training
+    row does not leak into its features. Calling fit and then transform on the training rows instead
+    leaks it, so the training rows must always go through fit_transform
+
+    :param n_neighbors: number of nearest neighbours for the median price
+    :param radius_km: radius for the neighbour density
+    """
+
+    # Approximate length of a degree of latitude, in km
+    _km_per_degree = 111.2
+
+    def __init__(self, n_neighbors=10, radius_km=0.5):
+        self.n_neighbors = n_neighbors
+        self.radius_km = radius_km
+
+    def _project(self, X):
+        lat_lon = np.asarray(X, dtype=np.float64)
+        # Fill missing coordinates with the center of the training listings
+        lat_lon = np.where(np.isnan(lat_lon), self.center_, lat_lon)
+
+        # Equirectangular projection, accurate enough at the scale of a city
+        return np.column_stack(
+            [
+                lat_lon[:, 0] * self._km_per_degree,
+                lat_lon[:, 1] * self._km_per_degree * np.cos(np.radians(self.center_[0])),
+            ]
+        )
+
+    def fit(self, X, y):
+        if len(X) < 2:
+            # With a single listing, excluding it from its own neighbours would leave none
+            raise ValueError(f"GeoNeighbourFeatures needs at least 2 training listings, got {len(X)}")
+
+        self.center_ = np.nanmean(np.asarray(X, dtype=np.float64), axis=0)
+        self.tree_ = cKDTree(self._project(X))
+        self.prices_ = np.asarray(y, dtype=np.float32)
+
+        return self
+
+    def _neighbour_features(self, X, exclude_self):
+        coords = self._project(X)
+        n_neighbors = min(self.n_neighbors + exclude_self, self.tree_.n)
+
+        density = self.tree_.query_ball_point(coords, r=self.radius_km, return_length=True) - exclude_self
+        _, idx = self.tree_.query(coords, k=n_neighbors)
+        idx = idx.reshape(len(coords), -1)
+
+        if exclude_self:
+            # Remove each row by index and not by position: with duplicate coordinates the row
+            # itself is not necessarily the first neighbour returned
+            keep = idx != np.arange(len(coords))[:, None]
+            # If the row is not among its neighbours (more duplicates than neighbours), drop the farthest
+            keep[keep.all(axis=1), -1] = False
+            idx = idx[keep].reshape(len(coords), -1)
+
+        return np.column_stack([density, np.median(self.prices_[idx], axis=1)]).astype(np.float32)
+
+    def transform(self, X):
+        return self._neighbour_features(X, exclude_self=0)
+
+    def fit_transform(self, X, y):
+        return self.fit(X, y)._neighbour_features(X, exclude_self=1)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(["neighbour_density", "knn_median_price"], dtype=object)
+
+
+def transform_in_chunks(transformer, X, chunksize=10000, n_jobs=-1):
+    """
+    Apply a fitted, row-wise independent transformer (like HashingTfidfVectorizer) to X in chunks,
+    processing the chunks in parallel and stacking the results
+
+    :param transformer: fitted transformer
+    :param X: 1d array-like of documents
+    :param chunksize: number of documents per chunk
+    :param n_jobs: number of parallel jobs (-1 means all available cores)
+    :return: sparse matrix with one row per document
     """
-    date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
-    return date_sanitized.apply(lambda d: (d.max() -d).dt.days, axis=0).to_numpy()
+    chunks = [X[i: i + chunksize] for i in range(0, len(X), chunksize)]
+    results = Parallel(n_jobs=n_jobs)(delayed(transformer.transform)(chunk) for chunk in chunks)
+    return sp.vstack(results, format="csr")
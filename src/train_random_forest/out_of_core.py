@@ -0,0 +1,204 @@
+"""
+Out-of-core training of the random forest: the rows of the trainval CSV are split in train and validation
+(as train_test_split would do in memory), the preprocessor is fit on a sample of the train rows, and the
+CSV is streamed in chunks through the fitted preprocessor into on-disk memory-mapped float32 matrices, and the trees are then fit on bootstrap
+samples drawn from those matrices, so the peak memory depends on the chunk and sample sizes
+and not on the size of the dataset
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+
+logger = logging.getLogger()
+
+
+def split_rows(csv_path, val_size, stratify_by, chunksize, random_seed):
+    """
+    Assign each row of the CSV to the train or the validation set, reading only the stratification
+    column. The assignment is the same that train_test_split gives on the whole dataset in memory
+    (as done by the in_memory training mode and by the model_diagnostics step)
+
+    :return: a boolean array, True for the rows in the validation set
+    """
+    from sklearn.model_selection import train_test_split
+
+    if stratify_by != "none":
+        strata = pd.concat(
+            [c[stratify_by] for c in pd.read_csv(csv_path, usecols=[stratify_by], chunksize=chunksize)],
+            ignore_index=True,
+        )
+        n_rows = len(strata)
+    else:
+        strata = None
+        n_rows = sum(len(c) for c in pd.read_csv(csv_path, usecols=[0], chunksize=chunksize))
+
+    _, val_idx = train_test_split(
+        np.arange(n_rows), test_size=val_size, stratify=strata, random_state=random_seed
+    )
+
+    is_val = np.zeros(n_rows, dtype=bool)
+    is_val[val_idx] = True
+
+    return is_val
+
+
+def sample_rows(csv_path, n_rows, chunksize, random_seed, mask=None):
+    """
+    Stream the CSV once, returning a uniform random sample of n_rows rows (reservoir sampling with
+    random priorities)
+
+    :param csv_path: path to the CSV file
+    :param n_rows: size of the sample
+    :param chunksize: number of rows read at a time
+    :param random_seed: seed for the random number generator
+    :param mask: optional boolean array, only the rows where it is True can be sampled
+    :return: the sample
+    """
+    rng = np.random.default_rng(random_seed)
+
+    sample = None
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        if mask is not None:
+            chunk_mask = mask[start: start + len(chunk)]
+            start += len(chunk)
+            chunk = chunk[chunk_mask]
+
+        chunk = chunk.assign(_priority=rng.random(len(chunk)))
+        sample = chunk if sample is None else pd.concat([sample, chunk])
+        sample = sample.nsmallest(n_rows, "_priority")
+
+    return sample.drop(columns="_priority").sort_index()
+
+
+def fit_idf_on_chunks(csv_path, text_pipe, mask, chunksize):
+    """
+    Refit the document frequencies of the HashingTfidfVectorizer at the end of text_pipe (a fitted
+    pipeline for the "name" column) with partial_fit, streaming the rows of the CSV where mask is True,
+    so that the IDF is estimated on all the train rows and not only on the sample the preprocessor
+    was fit on
+    """
+    vectorizer = text_pipe[-1]
+
+    start = 0
+    for i, chunk in enumerate(pd.read_csv(csv_path, usecols=["name"], chunksize=chunksize)):
+        chunk_mask = mask[start: start + len(chunk)]
+        start += len(chunk)
+
+        docs = text_pipe[:-1].transform(chunk[chunk_mask])
+        # The first chunk resets the frequencies estimated on the sample
+        if i == 0:
+            vectorizer.fit(docs)
+        else:
+            vectorizer.partial_fit(docs)
+
+    logger.info(f"Estimated the IDF of the name column on {vectorizer.n_documents_} rows")
+
+
+def build_memmap_features(csv_path, preprocessor, is_val, chunksize, memmap_dir):
+    """
+    Stream the CSV through the fitted preprocessor, writing the features and the target in
+    float32 .npy files in memmap_dir, split in train and validation according to is_val
+
+    :return: a tuple (X_train, y_train, X_val, y_val) of read-only memory-mapped arrays
+    """
+    os.makedirs(memmap_dir, exist_ok=True)
+
+    sizes = {"train": int((~is_val).sum()), "val": int(is_val.sum())}
+
+    arrays = {}
+    offsets = {"train": 0, "val": 0}
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        y = chunk.pop("price").to_numpy(dtype=np.float32)
+
+        features = preprocessor.transform(chunk)
+        if hasattr(features, "toarray"):
+            features = features.toarray()
+        features = np.asarray(features, dtype=np.float32)
+
+        if not arrays:
+            # We know the number of features only after transforming the first chunk
+            for split, size in sizes.items():
+                arrays[f"X_{split}"] = np.lib.format.open_memmap(
+                    os.path.join(memmap_dir, f"X_{split}.npy"),
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(size, features.shape[1]),
+                )
+                arrays[f"y_{split}"] = np.lib.format.open_memmap(
+                    os.path.join(memmap_dir, f"y_{split}.npy"), mode="w+", dtype=np.float32, shape=(size,)
+                )
+
+        chunk_is_val = is_val[start: start + len(chunk)]
+        start += len(chunk)
+
+        for split, mask in [("train", ~chunk_is_val), ("val", chunk_is_val)]:
+            n = int(mask.sum())
+            arrays[f"X_{split}"][offsets[split]: offsets[split] + n] = features[mask]
+            arrays[f"y_{split}"][offsets[split]: offsets[split] + n] = y[mask]
+            offsets[split] += n
+
+    for array in arrays.values():
+        array.flush()
+
+    return tuple(
+        np.load(os.path.join(memmap_dir, f"{k}.npy"), mmap_mode="r")
+        for k in ["X_train", "y_train", "X_val", "y_val"]
+    )
+
+
+def fit_forest_on_memmap(X, y, rf_config, max_samples, trees_per_batch, random_seed):
+    """
+    Fit a RandomForestRegressor on a (memory-mapped) matrix, growing the forest trees_per_batch trees
+    at a time. Each batch is fit on a bootstrap sample of max_samples rows drawn from the matrix,
+    so only that sample is ever loaded in memory. With trees_per_batch=1 (the default) each tree gets
+    its own bootstrap sample, like in a regular random forest. Larger batches fit faster (the trees of
+    a batch are fit in parallel), but their trees share the same sample, so they only differ if
+    max_features is below 1.0, and even then they are more correlated
+
+    :return: the fitted RandomForestRegressor
+    """
+    rng = np.random.default_rng(random_seed)
+
+    rf_config = dict(rf_config)
+    n_estimators = rf_config.pop("n_estimators", 100)
+    if rf_config.pop("oob_score", False):
+        # The out-of-bag samples are only defined with respect to the sample of each batch
+        logger.warning("oob_score is not supported in out-of-core mode, ignoring it")
+
+    # Each batch is already a bootstrap sample, bootstrapping it again would leave each tree with
+    # only ~40% unique rows instead of ~63%
+    rf_config.pop("bootstrap", None)
+    forest = RandomForestRegressor(n_estimators=0, warm_start=True, bootstrap=False, **rf_config)
+
+    max_samples = min(max_samples, X.shape[0])
+    while forest.n_estimators < n_estimators:
+        # Sorting the indices makes the reads from the memory map sequential
+        idx = np.sort(rng.integers(0, X.shape[0], size=max_samples))
+
+        forest.n_estimators = min(forest.n_estimators + trees_per_batch, n_estimators)
+        logger.info(f"Fitting trees up to {forest.n_estimators} of {n_estimators} on {max_samples} rows")
+        forest.fit(X[idx], y[idx])
+
+    forest.warm_start = False
+
+    return forest
+
+
+def score_on_memmap(forest, X, y, chunksize):
+    """
+    Compute the r2 and the MAE of the forest on a (memory-mapped) matrix, predicting in chunks
+
+    :return: a tuple (r2, mae)
+    """
+    y_pred = np.concatenate(
+        [forest.predict(X[i: i + chunksize]) for i in range(0, X.shape[0], chunksize)]
+    )
+
+    return r2_score(y, y_pred), mean_absolute_error(y, y_pred)
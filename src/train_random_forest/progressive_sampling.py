@@ -0,0 +1,126 @@
+"""
+Progressive sampling: the pipeline is trained on stratified subsamples of the training set of increasing size,
+until the validation metrics stop changing. Useful to quickly check whether a configuration is promising,
+before paying for a fit on the full dataset
+"""
+import logging
+import time
+
+import numpy as np
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+
+
+logger = logging.getLogger()
+
+
+def sample_sizes(n_rows, initial_size, growth_factor):
+    """
+    Return the geometric sequence of sample sizes initial_size, initial_size * growth_factor, ... up to n_rows
+    """
+    sizes = []
+    size = initial_size
+    while size < n_rows:
+        sizes.append(int(size))
+        size *= growth_factor
+
+    return sizes + [n_rows]
+
+
+def stratified_sample(X, y, n_rows, stratify_by, random_seed):
+    if n_rows >= len(X):
+        return X, y
+
+    X_sample, _, y_sample, _ = train_test_split(
+        X,
+        y,
+        train_size=n_rows,
+        stratify=X[stratify_by] if stratify_by != "none" else None,
+        random_state=random_seed,
+    )
+
+    return X_sample, y_sample
+
+
+def progressive_fit(
+    make_pipe,
+    X_train,
+    y_train,
+    X_val,
+    y_val,
+    stratify_by,
+    random_seed,
+    initial_size=1000,
+    growth_factor=2.0,
+    mae_tolerance=0.01,
+    r2_tolerance=0.005,
+):
+    """
+    Fit a new pipeline (created by make_pipe) on stratified subsamples of increasing size, stopping
+    when both the relative change of the validation MAE is within mae_tolerance and the change of the
+    validation r2 is within r2_tolerance with respect to the previous sample size. Raises a ValueError if
+    growth_factor is not greater than 1, or if initial_size is smaller than 1 or than the number of
+    classes of stratify_by
+
+    :return: a tuple (sk_pipe, learning_curve, converged) with the pipeline fit on the last sample, the
+             list of the metrics and fit times for each sample size, and whether the metrics converged
+    """
+    if growth_factor <= 1:
+        raise ValueError(f"growth_factor must be greater than 1, got {growth_factor}")
+
+    if initial_size < 1:
+        raise ValueError(f"initial_size must be at least 1, got {initial_size}")
+
+    # A stratified sample must contain at least one row for each class
+    if stratify_by != "none" and initial_size < X_train[stratify_by].nunique():
+        raise ValueError(
+            f"initial_size must be at least the number of values of {stratify_by} "
+            f"({X_train[stratify_by].nunique()}), got {initial_size}"
+        )
+
+    learning_curve = []
+    converged = False
+    for n_rows in sample_sizes(len(X_train), initial_size, growth_factor):
+        X_sample, y_sample = stratified_sample(X_train, y_train, n_rows, stratify_by, random_seed)
+
+        sk_pipe = make_pipe()
+        start = time.perf_counter()
+        sk_pipe.fit(X_sample, y_sample)
+        fit_time = time.perf_counter() - start
+
+        y_pred = sk_pipe.predict(X_val)
+        point = {
+            "n_rows": n_rows,
+            "fit_s": fit_time,
+            "mae": mean_absolute_error(y_val, y_pred),
+            "r2": r2_score(y_val, y_pred),
+        }
+        logger.info(f"Sample of {n_rows} rows: MAE {point['mae']:.3f}, r2 {point['r2']:.4f}, fit {fit_time:.1f}s")
+
+        if learning_curve:
+            previous = learning_curve[-1]
+            converged = (
+                abs(point["mae"] - previous["mae"]) <= mae_tolerance * previous["mae"]
+                and abs(point["r2"] - previous["r2"]) <= r2_tolerance
+            )
+
+        learning_curve.append(point)
+        if converged:
+            logger.info(f"Validation metrics converged with {n_rows} of {len(X_train)} rows")
+            break
+
+    return sk_pipe, learning_curve, converged
+
+
+def estimate_time_saved(learning_curve, n_rows):
+    """
+    Estimate the time that fitting on n_rows would have taken, assuming that the fit time grows linearly
+    with the number of rows from the last point of the learning curve
+
+    :return: a tuple (estimated full fit time, estimated time saved by the progressive sampling)
+    """
+    last = learning_curve[-1]
+    full_fit_time = last["fit_s"] * n_rows / last["n_rows"]
+    sampling_time = float(np.sum([p["fit_s"] for p in learning_curve]))
+
+    return full_fit_time, full_fit_time - sampling_time
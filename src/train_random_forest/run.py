@@ -6,30 +6,16 @@ import argparse
 import logging
 import os
 import shutil
-import matplotlib.pyplot as plt
-
-import mlflow
 import json
 
-import pandas as pd
-import numpy as np
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.impute import SimpleImputer
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OrdinalEncoder, FunctionTransformer, OneHotEncoder
-
-import wandb
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error
-from sklearn.pipeline import Pipeline, make_pipeline
-
 
 def delta_date_feature(dates):
     """
     Given a 2d array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
     between each date and the most recent date in its column
     """
+    import pandas as pd
+
     date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
     return date_sanitized.apply(lambda d: (d.max() -d).dt.days, axis=0).to_numpy()
 
@@ -39,6 +25,18 @@ logger = logging.getLogger()
 
 
 def go(args):
+    import cloudpickle
+    import mlflow
+    import pandas as pd
+    import wandb
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.model_selection import train_test_split
+
+    import feature_engineering
+
+    # Serialize the custom transformers together with the model, so that the exported model can be
+    # loaded by other steps (like test_regression_model) that do not have this module
+    cloudpickle.register_pickle_by_value(feature_engineering)
 
     run = wandb.init(job_type="train_random_forest")
     run.config.update(args)
@@ -53,35 +51,49 @@ def go(args):
 
     # Use run.use_artifact(...).file() to get the train and validation artifact
     # and save the returned path in train_local_path
-    trainval_local_path = run.use_artifact(args.trainval_artifact).file()
+    trainval_artifact = run.use_artifact(args.trainval_artifact)
+    trainval_local_path = trainval_artifact.file()
    
-    X = pd.read_csv(trainval_local_path)
-    y = X.pop("price")  # this removes the column "price" from X and puts it into y
-
-    logger.info(f"Minimum price: {y.min()}, Maximum price: {y.max()}")
-
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=args.val_size, stratify=X[args.stratify_by], random_state=args.random_seed
-    )
-
-    logger.info("Preparing sklearn pipeline")
-
-    sk_pipe, processed_features = get_inference_pipeline(rf_config, args.max_tfidf_features)
-
-    # Then fit it to the X_train, y_train data
-    logger.info("Fitting")
-
-    ######################################
-    # Fit the pipeline sk_pipe by calling the .fit method on X_train and y_train
-    # YOUR CODE HERE
-    ######################################
+    if args.training_mode == "out_of_core":
+        sk_pipe, processed_features, X_train, r_squared, mae = train_out_of_core(
+            trainval_local_path, rf_config, args
+        )
+    elif args.training_mode == "progressive_sampling":
+        sk_pipe, processed_features, X_train, r_squared, mae = train_progressive_sampling(
+            trainval_local_path, rf_config, args, run
+        )
+    elif args.training_mode == "distributed":
+        sk_pipe, processed_features, X_train, r_squared, mae = train_distributed(
+            trainval_local_path, rf_config, args
+        )
+    else:
+        X = pd.read_csv(trainval_local_path)
+        y = X.pop("price")  # this removes the column "price" from X and puts it into y
+
+        logger.info(f"Minimum price: {y.min()}, Maximum price: {y.max()}")
+
+        X_train, X_val, y_train, y_val = train_test_split(
+            X, y, test_size=args.val_size, stratify=X[args.stratify_by], random_state=args.random_seed
+        )
+
+        logger.info("Preparing sklearn pipeline")
+
+        sk_pipe, processed_features = get_pipeline_from_args(rf_config, args)
+
+        # Then fit it to the X_train, y_train data
+        logger.info("Fitting")
+
+        ######################################
+        # Fit the pipeline sk_pipe by calling the .fit method on X_train and y_train
+        # YOUR CODE HERE
+        ######################################
 
-    # Compute r2 and MAE
-    logger.info("Scoring")
-    r_squared = sk_pipe.score(X_val, y_val)
+        # Compute r2 and MAE
+        logger.info("Scoring")
+        r_squared = sk_pipe.score(X_val, y_val)
 
-    y_pred = sk_pipe.predict(X_val)
-    mae = mean_absolute_error(y_val, y_pred)
+        y_pred = sk_pipe.predict(X_val)
+        mae = mean_absolute_error(y_val, y_pred)
 
     logger.info(f"Score: {r_squared}")
     logger.info(f"MAE: {mae}")
@@ -107,7 +119,12 @@ def go(args):
         args.output_artifact,
         type = 'model_export',
         description = 'Trained ranfom forest artifact',
-        metadata = rf_config
+        metadata = dict(
+            rf_config,
+            # Models with the same fingerprint have identical fitted preprocessors, so
+            # test_regression_model can transform the data once for all of them
+            preprocessing_fingerprint = get_preprocessing_fingerprint(trainval_artifact.digest, args, run)
+        )
     )
     artifact.add_dir('random_forest_dir')
     run.log_artifact(artifact)
@@ -130,7 +147,227 @@ def go(args):
     )
 
 
+def train_out_of_core(trainval_local_path, rf_config, args):
+    """
+    Train the inference pipeline without ever loading the whole trainval dataset in memory.
+    The preprocessor is fit on a random sample of the train rows, then the dataset is streamed
+    through it into memory-mapped matrices on which the random forest is trained
+
+    :return: a tuple (sk_pipe, processed_features, X_sample, r_squared, mae) where X_sample is the
+             sample the preprocessor was fit on
+    """
+    import out_of_core
+
+    if args.geo_features:
+        # The preprocessor is fit on a sample and then only used with transform, so the geo features
+        # of the training rows in the sample would contain their own price
+        raise ValueError("geo_features is not supported in out_of_core mode")
+
+    # Split first, so that the preprocessor never sees the validation rows
+    logger.info("Splitting the rows in train and validation")
+    is_val = out_of_core.split_rows(
+        trainval_local_path, args.val_size, args.stratify_by, args.chunksize, args.random_seed
+    )
+    logger.info(f"The trainval dataset contains {len(is_val)} rows")
+
+    logger.info(f"Sampling {args.preprocessor_sample_rows} train rows to fit the preprocessor")
+    X_sample = out_of_core.sample_rows(
+        trainval_local_path, args.preprocessor_sample_rows, args.chunksize, args.random_seed, mask=~is_val
+    )
+    y_sample = X_sample.pop("price")
+
+    sk_pipe, processed_features = get_pipeline_from_args(rf_config, args)
+    preprocessor = sk_pipe["preprocessor"].fit(X_sample, y_sample)
+
+    if args.text_featurizer == "hashing" and args.hashing_use_idf:
+        # The hashing featurizer has no vocabulary to fit, so its IDF can be estimated on all the
+        # train rows, one chunk at a time, instead of only on the sample
+        logger.info("Estimating the IDF of the name column on all the train rows")
+        out_of_core.fit_idf_on_chunks(
+            trainval_local_path, preprocessor.named_transformers_["transform_name"], ~is_val, args.chunksize
+        )
+
+    # NOTE: delta_date_feature measures the days since the most recent review in the batch it
+    # transforms, so here it is relative to each chunk (as it is relative to each batch at inference)
+    logger.info(f"Streaming the dataset through the preprocessor into {args.memmap_dir}")
+    X_train, y_train, X_val, y_val = out_of_core.build_memmap_features(
+        trainval_local_path, preprocessor, is_val, args.chunksize, args.memmap_dir
+    )
+
+    logger.info("Fitting")
+    sk_pipe.steps[-1] = (
+        "random_forest",
+        out_of_core.fit_forest_on_memmap(
+            X_train, y_train, rf_config, args.max_samples, args.trees_per_batch, args.random_seed
+        ),
+    )
+
+    logger.info("Scoring")
+    r_squared, mae = out_of_core.score_on_memmap(sk_pipe["random_forest"], X_val, y_val, args.chunksize)
+
+    # The memory-mapped matrices can be as large as the dataset, do not leave them around
+    del X_train, y_train, X_val, y_val
+    shutil.rmtree(args.memmap_dir)
+
+    return sk_pipe, processed_features, X_sample, r_squared, mae
+
+
+def train_distributed(trainval_local_path, rf_config, args):
+    """
+    Train the inference pipeline fitting the preprocessor here, and distributing the trees of the random
+    forest across several worker processes (possibly on other nodes) that receive the preprocessed matrix
+
+    :return: a tuple (sk_pipe, processed_features, X_train, r_squared, mae)
+    """
+    import pandas as pd
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.model_selection import train_test_split
+
+    import distributed
+
+    X = pd.read_csv(trainval_local_path)
+    y = X.pop("price")
+
+    X_train, X_val, y_train, y_val = train_test_split(
+        X, y, test_size=args.val_size, stratify=X[args.stratify_by], random_state=args.random_seed
+    )
+
+    sk_pipe, processed_features = get_pipeline_from_args(rf_config, args)
+
+    logger.info("Fitting the preprocessor")
+    features = sk_pipe["preprocessor"].fit_transform(X_train, y_train)
+    if hasattr(features, "toarray"):
+        features = features.toarray()
+
+    logger.info(f"Fitting the random forest on {args.n_workers} workers ({args.distributed_backend})")
+    if args.distributed_backend == "shared_memory":
+        forest = distributed.fit_shared_memory(
+            features, y_train, rf_config, args.n_workers, args.random_seed, worker_n_jobs=args.worker_n_jobs
+        )
+    else:
+        forest = distributed.fit_socket(
+            features,
+            y_train,
+            rf_config,
+            args.n_workers,
+            args.random_seed,
+            address=args.coordinator_address,
+            n_local_workers=args.n_local_workers,
+            worker_n_jobs=args.worker_n_jobs,
+        )
+    sk_pipe.steps[-1] = ("random_forest", forest)
+
+    logger.info("Scoring")
+    r_squared = sk_pipe.score(X_val, y_val)
+    mae = mean_absolute_error(y_val, sk_pipe.predict(X_val))
+
+    return sk_pipe, processed_features, X_train, r_squared, mae
+
+
+def train_progressive_sampling(trainval_local_path, rf_config, args, run):
+    """
+    Train the inference pipeline on stratified subsamples of increasing size until the validation metrics
+    converge, logging the learning curve and an estimate of the time saved with respect to a full fit
+
+    :return: a tuple (sk_pipe, processed_features, X_train, r_squared, mae) for the last subsample
+    """
+    import pandas as pd
+    import wandb
+    from sklearn.model_selection import train_test_split
+
+    import progressive_sampling
+
+    X = pd.read_csv(trainval_local_path)
+    y = X.pop("price")
+
+    X_train, X_val, y_train, y_val = train_test_split(
+        X, y, test_size=args.val_size, stratify=X[args.stratify_by], random_state=args.random_seed
+    )
+
+    logger.info("Fitting on subsamples of increasing size")
+    sk_pipe, learning_curve, converged = progressive_sampling.progressive_fit(
+        lambda: get_pipeline_from_args(rf_config, args)[0],
+        X_train,
+        y_train,
+        X_val,
+        y_val,
+        args.stratify_by,
+        args.random_seed,
+        initial_size=args.sampling_initial_size,
+        growth_factor=args.sampling_growth_factor,
+        mae_tolerance=args.sampling_mae_tolerance,
+        r2_tolerance=args.sampling_r2_tolerance,
+    )
+
+    full_fit_time, time_saved = progressive_sampling.estimate_time_saved(learning_curve, len(X_train))
+    logger.info(f"Estimated full fit time: {full_fit_time:.1f}s, estimated time saved: {time_saved:.1f}s")
+
+    curve = wandb.Table(dataframe=pd.DataFrame(learning_curve))
+    run.log(
+        {
+            "learning_curve": curve,
+            "learning_curve_mae": wandb.plot.line(curve, "n_rows", "mae", title="Validation MAE vs sample size"),
+            "learning_curve_r2": wandb.plot.line(curve, "n_rows", "r2", title="Validation r2 vs sample size"),
+        }
+    )
+    run.summary["sampling_converged"] = converged
+    run.summary["sampling_n_rows"] = learning_curve[-1]["n_rows"]
+    run.summary["estimated_full_fit_s"] = full_fit_time
+    run.summary["estimated_time_saved_s"] = time_saved
+
+    _, processed_features = get_pipeline_from_args(rf_config, args)
+
+    return sk_pipe, processed_features, X_train, learning_curve[-1]["r2"], learning_curve[-1]["mae"]
+
+
+def get_preprocessing_fingerprint(trainval_digest, args, run):
+    """
+    Return a hash of everything that determines the fitted preprocessor: the training data, the
+    train/validation split, the preprocessing parameters and the rows the preprocessor is fit on
+    (which depend on the training mode)
+    """
+    import hashlib
+
+    fingerprint = {
+        "trainval_digest": trainval_digest,
+        "val_size": args.val_size,
+        "random_seed": args.random_seed,
+        "stratify_by": args.stratify_by,
+        "max_tfidf_features": args.max_tfidf_features,
+        "text_featurizer": args.text_featurizer,
+        "hashing_n_features": args.hashing_n_features,
+        "hashing_use_idf": args.hashing_use_idf,
+        "geo_features": args.geo_features,
+        "geo_n_neighbors": args.geo_n_neighbors,
+        "geo_radius_km": args.geo_radius_km,
+    }
+
+    # in_memory and distributed both fit the preprocessor on the whole train split
+    if args.training_mode == "out_of_core":
+        fingerprint["preprocessor_sample_rows"] = args.preprocessor_sample_rows
+    elif args.training_mode == "progressive_sampling":
+        fingerprint["sampling_n_rows"] = run.summary["sampling_n_rows"]
+
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def get_pipeline_from_args(rf_config, args):
+    return get_inference_pipeline(
+        rf_config,
+        args.max_tfidf_features,
+        text_featurizer=args.text_featurizer,
+        hashing_n_features=args.hashing_n_features,
+        hashing_use_idf=args.hashing_use_idf,
+        geo_features=args.geo_features,
+        geo_n_neighbors=args.geo_n_neighbors,
+        geo_radius_km=args.geo_radius_km,
+    )
+
+
 def plot_feature_importance(pipe, feat_names):
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     # We collect the feature importance for all non-nlp features first
     feat_imp = pipe["random_forest"].feature_importances_[: len(feat_names)-1]
     # For the NLP feature we sum across all the TF-IDF dimensions into a global
@@ -146,7 +383,26 @@ def plot_feature_importance(pipe, feat_names):
     return fig_feat_imp
 
 
-def get_inference_pipeline(rf_config, max_tfidf_features):
+def get_inference_pipeline(
+    rf_config,
+    max_tfidf_features,
+    text_featurizer="tfidf",
+    hashing_n_features=1024,
+    hashing_use_idf=True,
+    geo_features=False,
+    geo_n_neighbors=10,
+    geo_radius_km=0.5,
+):
+    import numpy as np
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline, make_pipeline
+    from sklearn.preprocessing import OrdinalEncoder, FunctionTransformer, OneHotEncoder
+
+    from feature_engineering import GeoNeighbourFeatures, HashingTfidfVectorizer
+
     # Let's handle the categorical features first
     # Ordinal categorical are categorical values for which the order is meaningful, for example
     # for room type: 'Entire home/apt' > 'Private room' > 'Shared room'
@@ -190,29 +446,65 @@ def get_inference_pipeline(rf_config, max_tfidf_features):
 
     # Some minimal NLP for the "name" column
     reshape_to_1d = FunctionTransformer(np.reshape, kw_args={"newshape": -1})
-    name_tfidf = make_pipeline(
-        SimpleImputer(strategy="constant", fill_value=""),
-        reshape_to_1d,
-        TfidfVectorizer(
+    # The "hashing" featurizer does not fit (nor store) a vocabulary, so it is cheaper to fit
+    # and to serialize, and it can be applied to chunks of data in parallel
+    if text_featurizer == "tfidf":
+        name_vectorizer = TfidfVectorizer(
             binary=False,
             max_features=max_tfidf_features,
             stop_words='english'
-        ),
+        )
+    elif text_featurizer == "hashing":
+        name_vectorizer = HashingTfidfVectorizer(
+            n_features=hashing_n_features,
+            use_idf=hashing_use_idf,
+            stop_words='english'
+        )
+    else:
+        raise ValueError(f"Unknown text featurizer {text_featurizer}. Use 'tfidf' or 'hashing'")
+
+    name_tfidf = make_pipeline(
+        SimpleImputer(strategy="constant", fill_value=""),
+        reshape_to_1d,
+        name_vectorizer,
     )
 
+    # Optional geo features: density of listings and median price of the nearest listings,
+    # looked up in a spatial index (KD-tree) built on the training set
+    geo_transformers = []
+    geo_processed_features = []
+    if geo_features:
+        geo_transformers = [
+            (
+                "geo_neighbours",
+                GeoNeighbourFeatures(n_neighbors=geo_n_neighbors, radius_km=geo_radius_km),
+                ["latitude", "longitude"],
+            )
+        ]
+        geo_processed_features = ["neighbour_density", "knn_median_price"]
+
     # Let's put everything together
+    # NOTE: the name must stay the last one, because it is expanded in several columns
     preprocessor = ColumnTransformer(
         transformers=[
             ("ordinal_cat", ordinal_categorical_preproc, ordinal_categorical),
             ("non_ordinal_cat", non_ordinal_categorical_preproc, non_ordinal_categorical),
             ("impute_zero", zero_imputer, zero_imputed),
             ("transform_date", date_imputer, ["last_review"]),
+            *geo_transformers,
             ("transform_name", name_tfidf, ["name"])
         ],
         remainder="drop",  # This drops the columns that we do not transform
     )
 
-    processed_features = ordinal_categorical + non_ordinal_categorical + zero_imputed + ["last_review", "name"]
+    processed_features = (
+        ordinal_categorical
+        + non_ordinal_categorical
+        + zero_imputed
+        + ["last_review"]
+        + geo_processed_features
+        + ["name"]
+    )
 
     # Create random forest
     random_forest = RandomForestRegressor(**rf_config)
@@ -279,6 +571,170 @@ if __name__ == "__main__":
         type=int
     )
 
+    parser.add_argument(
+        "--text_featurizer",
+        type=str,
+        help="Featurizer for the title of the insertion: 'tfidf' (fitted vocabulary) or 'hashing' "
+        "(feature hashing with a streaming IDF estimate)",
+        choices=["tfidf", "hashing"],
+        default="tfidf",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--hashing_n_features",
+        help="Number of hashed columns for the 'hashing' text featurizer",
+        default=1024,
+        type=int
+    )
+
+    parser.add_argument(
+        "--hashing_use_idf",
+        help="Whether the 'hashing' text featurizer re-weights the counts with the IDF (true/false)",
+        default=True,
+        type=lambda s: s.lower() in ("true", "1", "yes")
+    )
+
+    parser.add_argument(
+        "--geo_features",
+        help="Whether to add the neighbour density and the median price of the nearest listings "
+        "as features (true/false)",
+        default=False,
+        type=lambda s: s.lower() in ("true", "1", "yes")
+    )
+
+    parser.add_argument(
+        "--geo_n_neighbors",
+        help="Number of nearest listings for the median price geo feature",
+        default=10,
+        type=int
+    )
+
+    parser.add_argument(
+        "--geo_radius_km",
+        help="Radius (in km) for the neighbour density geo feature",
+        default=0.5,
+        type=float
+    )
+
+    parser.add_argument(
+        "--training_mode",
+        type=str,
+        help="'in_memory' reads the whole dataset in memory, 'out_of_core' streams it in chunks "
+        "into memory-mapped matrices and fits the trees on bootstrap samples drawn from them, "
+        "'distributed' fits subsets of the trees on separate worker processes or nodes, "
+        "'progressive_sampling' fits on stratified subsamples of increasing size until the validation "
+        "metrics converge (for fast iterations)",
+        choices=["in_memory", "out_of_core", "distributed", "progressive_sampling"],
+        default="in_memory",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows read at a time in out-of-core mode",
+        default=100000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--preprocessor_sample_rows",
+        help="Number of randomly sampled rows used to fit the preprocessor in out-of-core mode",
+        default=100000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--max_samples",
+        help="Number of rows of the bootstrap sample each batch of trees is fit on in out-of-core mode",
+        default=500000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--trees_per_batch",
+        help="Number of trees fit on each bootstrap sample in out-of-core mode",
+        default=1,
+        type=int
+    )
+
+    parser.add_argument(
+        "--memmap_dir",
+        type=str,
+        help="Directory for the memory-mapped feature matrices in out-of-core mode",
+        default="features_memmap",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--distributed_backend",
+        type=str,
+        help="How the preprocessed matrix is shipped to the workers in distributed mode: "
+        "'shared_memory' (local workers only) or 'socket' (local and/or remote workers)",
+        choices=["shared_memory", "socket"],
+        default="shared_memory",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--n_workers",
+        help="Number of workers in distributed mode",
+        default=2,
+        type=int
+    )
+
+    parser.add_argument(
+        "--n_local_workers",
+        help="Number of workers started on this machine with the 'socket' backend. The remaining ones "
+        "must be started on other nodes with distributed.py",
+        default=None,
+        type=int
+    )
+
+    parser.add_argument(
+        "--worker_n_jobs",
+        help="Number of cores used by each worker in distributed mode",
+        default=1,
+        type=int
+    )
+
+    parser.add_argument(
+        "--coordinator_address",
+        type=str,
+        help="Address (host:port) the coordinator listens on with the 'socket' backend. "
+        "Port 0 picks a free port (only useful with local workers)",
+        default="localhost:0",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--sampling_initial_size",
+        help="Size of the first subsample in progressive_sampling mode",
+        default=1000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--sampling_growth_factor",
+        help="Factor by which the size of the subsample grows at each step in progressive_sampling mode",
+        default=2.0,
+        type=float
+    )
+
+    parser.add_argument(
+        "--sampling_mae_tolerance",
+        help="Maximum relative change of the validation MAE to consider it converged in progressive_sampling mode",
+        default=0.01,
+        type=float
+    )
+
+    parser.add_argument(
+        "--sampling_r2_tolerance",
+        help="Maximum change of the validation r2 to consider it converged in progressive_sampling mode",
+        default=0.005,
+        type=float
+    )
+
     parser.add_argument(
         "--output_artifact",
         type=str,
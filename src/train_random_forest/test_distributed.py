@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import distributed
+
+
+RF_CONFIG = {"n_estimators": 20, "max_depth": 6, "n_jobs": -1}
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(42)
+    X = rng.random((600, 5))
+    y = 10 * X[:, 0] + 5 * X[:, 1] ** 2 + rng.normal(scale=0.5, size=600)
+    return X[:400], y[:400], X[400:], y[400:]
+
+
+@pytest.mark.parametrize("fit", [distributed.fit_shared_memory, distributed.fit_socket])
+def test_merged_forest_matches_single_process(data, fit):
+    X_train, y_train, X_val, y_val = data
+
+    forest = fit(X_train, y_train, RF_CONFIG, n_workers=2, random_seed=42)
+    reference = RandomForestRegressor(**RF_CONFIG, random_state=42).fit(X_train, y_train)
+
+    assert len(forest.estimators_) == forest.n_estimators == RF_CONFIG["n_estimators"]
+    # The merged forest predicts with the configured number of cores, not with those of a worker
+    assert forest.n_jobs == RF_CONFIG["n_jobs"]
+    assert forest.score(X_val, y_val) == pytest.approx(reference.score(X_val, y_val), abs=0.05)
+
+
+def test_socket_raises_if_workers_do_not_connect(data, monkeypatch):
+    X_train, y_train, _, _ = data
+    monkeypatch.setenv(distributed.AUTHKEY_ENV_VAR, "secret")
+
+    with pytest.raises(RuntimeError, match="0 of 1 workers connected"):
+        distributed.fit_socket(
+            X_train, y_train, RF_CONFIG, n_workers=1, random_seed=42, n_local_workers=0, connect_timeout=1
+        )
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""
+This script runs a hyperparameter sweep of the random forest with a pool of warm worker processes, as a
+faster alternative to a Hydra multirun of main.py (which starts new mlflow runs and new environments, and
+downloads and preprocesses the data again, for every trial).
+
+Each worker imports the dependencies, downloads the trainval artifact and fits the preprocessor once,
+keeping them in memory, so each trial only fits and scores the random forest. The parameters to sweep are
+given with the Hydra syntax used by multirun, for example:
+
+    > python sweep.py modeling.random_forest.max_depth=10,50 modeling.random_forest.n_estimators=100,200
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+# The sweep only changes the modeling section. Trials with the same values for these keys share the same
+# train/validation split and the same fitted preprocessor
+_split_keys = ["val_size", "random_seed", "stratify_by"]
+_preprocessing_keys = [
+    "max_tfidf_features",
+    "text_featurizer",
+    "hashing_n_features",
+    "hashing_use_idf",
+    "geo_features",
+    "geo_n_neighbors",
+    "geo_radius_km",
+]
+
+
+def expand_overrides(overrides):
+    """
+    Expand Hydra multirun overrides (key=value1,value2 ...) into the list of overrides of each trial
+    """
+    choices = []
+    for override in overrides:
+        key, values = override.split("=", 1)
+        choices.append([f"{key}={value}" for value in values.split(",")])
+
+    return [list(trial) for trial in itertools.product(*choices)]
+
+
+def compose_config(overrides):
+    from hydra import compose, initialize
+    from omegaconf import OmegaConf
+
+    with initialize(version_base=None, config_path="."):
+        return OmegaConf.to_container(compose(config_name="config", overrides=overrides), resolve=True)
+
+
+class _WarmTrainer:
+    """
+    State of a worker: the training data and the fitted preprocessors, cached by split and preprocessing
+    parameters so that only the random forest is fit for each trial. The split and the preprocessor of
+    warmup_modeling (a modeling section of the configuration) are fit right away, while warming up
+    """
+
+    def __init__(self, trainval_artifact, warmup_modeling):
+        import wandb
+
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "train_random_forest"))
+        # Importing here (once per worker) all the dependencies used by the trials
+        import pandas  # noqa: F401
+        import sklearn.ensemble  # noqa: F401
+        import run as train_random_forest
+
+        self.train_random_forest = train_random_forest
+        self.trainval_artifact = wandb.Api().artifact(f"{os.environ['WANDB_PROJECT']}/{trainval_artifact}")
+        self.trainval_local_path = self.trainval_artifact.file()
+        self.splits = {}
+        self.features = {}
+
+        self.get_features(warmup_modeling)
+
+    def get_split(self, modeling):
+        import pandas as pd
+        from sklearn.model_selection import train_test_split
+
+        key = json.dumps([modeling[k] for k in _split_keys])
+        if key not in self.splits:
+            X = pd.read_csv(self.trainval_local_path)
+            y = X.pop("price")
+
+            self.splits[key] = train_test_split(
+                X,
+                y,
+                test_size=modeling["val_size"],
+                stratify=X[modeling["stratify_by"]] if modeling["stratify_by"] != "none" else None,
+                random_state=modeling["random_seed"],
+            )
+
+        return key, self.splits[key]
+
+    def get_features(self, modeling):
+        split_key, (X_train, X_val, y_train, y_val) = self.get_split(modeling)
+
+        key = json.dumps([split_key] + [modeling.get(k) for k in _preprocessing_keys])
+        if key not in self.features:
+            sk_pipe, _ = self.train_random_forest.get_inference_pipeline(
+                {},
+                modeling["max_tfidf_features"],
+                text_featurizer=modeling.get("text_featurizer", "tfidf"),
+                hashing_n_features=modeling.get("hashing_n_features", 1024),
+                hashing_use_idf=modeling.get("hashing_use_idf", True),
+                geo_features=modeling.get("geo_features", False),
+                geo_n_neighbors=modeling.get("geo_n_neighbors", 10),
+                geo_radius_km=modeling.get("geo_radius_km", 0.5),
+            )
+            preprocessor = sk_pipe["preprocessor"]
+            self.features[key] = (
+                preprocessor.fit_transform(X_train, y_train),
+                preprocessor.transform(X_val),
+                y_train,
+                y_val,
+            )
+
+        return self.features[key]
+
+    def run_trial(self, config, overrides):
+        import wandb
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.metrics import mean_absolute_error, r2_score
+
+        modeling = config["modeling"]
+        X_train, X_val, y_train, y_val = self.get_features(modeling)
+
+        rf_config = dict(modeling["random_forest"], random_state=modeling["random_seed"])
+
+        start = time.perf_counter()
+        forest = RandomForestRegressor(**rf_config).fit(X_train, y_train)
+        fit_time = time.perf_counter() - start
+
+        y_pred = forest.predict(X_val)
+        result = {"r2": r2_score(y_val, y_pred), "mae": mean_absolute_error(y_val, y_pred), "fit_s": fit_time}
+
+        with wandb.init(job_type="sweep_trial", config=dict(modeling, overrides=overrides)) as run:
+            # Mark the version of the data used by the trial as an input of its run, for the lineage
+            run.use_artifact(self.trainval_artifact)
+            run.summary.update(result)
+
+        return result
+
+
+def _worker(conn, trainval_artifact, warmup_modeling):
+    try:
+        trainer = _WarmTrainer(trainval_artifact, warmup_modeling)
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+
+    conn.send(("ready", None))
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+
+        config, overrides = message
+        try:
+            conn.send(("done", trainer.run_trial(config, overrides)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes. Trials are dispatched to the first idle worker (so faster workers run
+    more trials), and a worker exceeding the timeout on a trial is killed and replaced (if trials are
+    still pending). Workers are warm once they have fit the preprocessor of warmup_modeling (see
+    _WarmTrainer), and a worker that does not become warm within warmup_timeout stops the sweep
+    """
+
+    def __init__(self, n_workers, trainval_artifact, warmup_modeling, trial_timeout, warmup_timeout):
+        self.trainval_artifact = trainval_artifact
+        self.warmup_modeling = warmup_modeling
+        self.trial_timeout = trial_timeout
+        self.warmup_timeout = warmup_timeout
+        self.workers = {}
+        for _ in range(n_workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        parent_conn, child_conn = Pipe()
+        process = Process(
+            target=_worker, args=(child_conn, self.trainval_artifact, self.warmup_modeling), daemon=True
+        )
+        process.start()
+        # Each worker is (process, current trial, deadline). A new worker is busy, with no trial but with
+        # a deadline, until it is warm
+        self.workers[parent_conn] = (process, None, time.monotonic() + self.warmup_timeout)
+
+    def _stop_worker(self, conn):
+        process, _, _ = self.workers.pop(conn)
+        process.kill()
+        process.join()
+        conn.close()
+
+    def run(self, trials):
+        """
+        Run the trials, a list of (trial id, config, overrides)
+
+        :return: a dictionary trial id -> result (a dictionary with the metrics, or with an "error")
+        """
+        pending = list(reversed(trials))
+        results = {}
+        idle = []
+
+        while len(results) < len(trials):
+            while idle and pending:
+                conn = idle.pop()
+                trial_id, config, overrides = pending.pop()
+                logger.info(f"Trial {trial_id}: {' '.join(overrides)}")
+                conn.send((config, overrides))
+                self.workers[conn] = (self.workers[conn][0], trial_id, time.monotonic() + self.trial_timeout)
+
+            deadlines = [d for _, _, d in self.workers.values() if d is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+
+            for conn in wait(list(self.workers), timeout=timeout):
+                process, trial_id, deadline = self.workers[conn]
+                try:
+                    status, payload = conn.recv()
+                except EOFError:
+                    status, payload = "died", "The worker died"
+
+                if status == "failed" or (status == "died" and trial_id is None and deadline is not None):
+                    raise RuntimeError(f"A worker could not start: {payload}")
+
+                if trial_id is not None:
+                    results[trial_id] = payload if status == "done" else {"error": payload}
+                    logger.info(f"Trial {trial_id}: {results[trial_id]}")
+
+                if status == "died":
+                    self._stop_worker(conn)
+                    if pending:
+                        self._start_worker()
+                else:
+                    self.workers[conn] = (process, None, None)
+                    idle.append(conn)
+
+            now = time.monotonic()
+            for conn, (process, trial_id, deadline) in list(self.workers.items()):
+                if deadline is None or now <= deadline:
+                    continue
+
+                if trial_id is None:
+                    self._stop_worker(conn)
+                    raise RuntimeError(f"A worker did not become ready within {self.warmup_timeout}s")
+
+                logger.warning(f"Trial {trial_id} timed out, stopping its worker")
+                results[trial_id] = {"error": f"Timed out after {self.trial_timeout}s"}
+                self._stop_worker(conn)
+                if pending:
+                    self._start_worker()
+
+        return results
+
+    def close(self):
+        for conn, (process, _, _) in self.workers.items():
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+
+
+def go(args):
+    base_config = compose_config([])
+
+    # All the trials are grouped under this name, like the runs of main.py
+    os.environ["WANDB_PROJECT"] = base_config["main"]["project_name"]
+    os.environ["WANDB_RUN_GROUP"] = args.group or f"{base_config['main']['experiment_name']}_sweep"
+
+    trials = [
+        (trial_id, compose_config(overrides), overrides)
+        for trial_id, overrides in enumerate(expand_overrides(args.overrides))
+    ]
+    logger.info(f"Running {len(trials)} trials on {args.n_workers} warm workers")
+
+    start = time.perf_counter()
+    # The workers fit the preprocessor of the first trial while warming up: it is the one of the base
+    # configuration unless the sweep changes the preprocessing
+    pool = WorkerPool(
+        args.n_workers, args.trainval_artifact, trials[0][1]["modeling"], args.trial_timeout, args.warmup_timeout
+    )
+    try:
+        results = pool.run(trials)
+    finally:
+        pool.close()
+    logger.info(f"Sweep completed in {time.perf_counter() - start:.1f}s")
+
+    rows = [
+        dict(trial=trial_id, overrides=" ".join(overrides), **results[trial_id])
+        for trial_id, _, overrides in trials
+    ]
+    rows.sort(key=lambda r: r.get("mae", float("inf")))
+    for row in rows:
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a sweep of the random forest with warm workers")
+
+    parser.add_argument(
+        "overrides",
+        type=str,
+        nargs="*",
+        help="Parameters to sweep, with the Hydra multirun syntax (key=value1,value2)",
+    )
+
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        help="Number of warm worker processes. Consider reducing modeling.random_forest.n_jobs accordingly",
+        default=2,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--trial_timeout",
+        type=float,
+        help="Maximum time (in seconds) for a trial, after which its worker is killed and replaced",
+        default=3600,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--warmup_timeout",
+        type=float,
+        help="Maximum time (in seconds) for a worker to download the data and fit the preprocessor",
+        default=600,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--trainval_artifact",
+        type=str,
+        help="Artifact containing the training dataset. It will be split into train and validation",
+        default="trainval_data.csv:latest",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--group",
+        type=str,
+        help="W&B group for the runs of the trials (default: [experiment_name]_sweep)",
+        default=None,
+        required=False,
+    )
+
+    args = parser.parse_args()
+
+    go(args)